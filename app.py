@@ -1,21 +1,55 @@
 import json
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import streamlit as st
 
 from src.fhir import make_fhir_diag_report
 from src.inference import (
-    FINDING_MODELS, process_file, run_classifiers, run_vlm, compute_urgency,
+    FINDING_MODELS, CLASSIFIER_MODELS, process_file, run_classifiers_and_vlm, compute_urgency,
     create_study, add_image, patient_label, patient_verdict, is_likely_normal,
-    run_classifiers_with_payload, run_vlm_with_payload, extract_keywords
+    run_classifiers_and_vlm_with_payload, extract_keywords
 )
+from src.media import read_dicom_meta, read_upload
 
 st.set_page_config(page_title="HOPPR Copilot", page_icon="🩻", layout="wide", initial_sidebar_state="expanded")
 st.title("🩻 InsightRay: Powered by HOPPR")
 st.caption("Built with the HOPPR Python SDK (`hopprai`).")
 
+BATCH_WORKERS = 8
+TONE_COLORS = {"red": "#f87171", "amber": "#f59e0b", "green": "#34d399"}
+
+TRIAGE_COLUMNS = ["Study ID", "File", "Urgency", "Top Findings"]
+
+def triage_frame(rows: list) -> pd.DataFrame:
+    # Derived from triage_rows (the single source of truth); rebuilt once per batch, not per rerun
+    records = [(r["study_id"], r["file"], r["urgency"], r["top_summary"]) for r in rows]
+    return pd.DataFrame.from_records(records, columns=TRIAGE_COLUMNS).astype({"Urgency": "float32"})
+
 if "triage_rows" not in st.session_state:
     st.session_state.triage_rows = []
+if "triage_df" not in st.session_state:
+    st.session_state.triage_df = triage_frame(st.session_state.triage_rows)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_fhir(study_id: str, scores_frozen: tuple, vlm_text: str) -> dict:
+    # Reruns (slider tweaks, tab switches) reuse the report built for the same inputs
+    return make_fhir_diag_report(study_id, dict(scores_frozen), vlm_text)
+
+def score_chart(ranked: list) -> None:
+    # Bars in the given (ranked) order on a fixed 0–1 axis so low probabilities read as low
+    st.vega_lite_chart(
+        pd.DataFrame(ranked, columns=["Finding", "Probability"]),
+        {
+            "mark": "bar",
+            "encoding": {
+                "x": {"field": "Finding", "type": "nominal", "sort": None,  # keep the caller's ranking
+                      "axis": {"labelAngle": -20}},
+                "y": {"field": "Probability", "type": "quantitative",
+                      "title": "Probability (0–1)", "scale": {"domain": [0, 1]}},
+            },
+        },
+        use_container_width=True,
+    )
 
 def color_dot(score: float) -> str:
     if score >= 0.70: return "🔴"
@@ -25,12 +59,13 @@ def color_dot(score: float) -> str:
 # Sidebar
 with st.sidebar:
     st.subheader("Choose Findings")
-    active_models = {}
+    enabled = set()
     for display_name, model_id in FINDING_MODELS.items():
         label = display_name if model_id else f"{display_name} (VLM only)"
         default_on = display_name in {"Pneumothorax", "Pleural Effusion", "Cardiomegaly"}
         if st.checkbox(label, value=default_on):
-            active_models[display_name] = model_id  # may be None (VLM-only)
+            enabled.add(display_name)  # may be VLM-only
+    active_models = [(n, m) for n, m in CLASSIFIER_MODELS if n in enabled]
     st.subheader("Mode")
     mode = st.radio("View", ["Technician", "Patient"], horizontal=True)
 
@@ -48,25 +83,33 @@ if mode == "Technician":
         clear_batch = col_b.button("Clear Queue", use_container_width=True)
         if clear_batch:
             st.session_state.triage_rows = []
+            st.session_state.triage_df = triage_frame(st.session_state.triage_rows)
         if run_batch:
             if not files:
                 st.error("Please select one or more files.")
-            elif not active_models:
+            elif not enabled:
                 st.error("Select at least one finding to screen.")
             else:
                 with st.spinner(f"Running {len(files)} file(s)…"):
-                    for f in files:
-                        row = process_file(f, active_models)
-                        st.session_state.triage_rows.append(row)
+                    progress = st.progress(0.0, text=f"0/{len(files)} done")
+                    try:
+                        # Network-bound per file; UI updates stay on the script thread
+                        with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(files))) as ex:
+                            futures = {ex.submit(process_file, f, active_models): f.name for f in files}
+                            for done, fut in enumerate(as_completed(futures), start=1):
+                                try:
+                                    st.session_state.triage_rows.append(fut.result())
+                                except Exception as e:
+                                    st.error(f"{futures[fut]}: {e}")
+                                progress.progress(done / len(files), text=f"{done}/{len(files)} done")
+                    finally:
+                        st.session_state.triage_df = triage_frame(st.session_state.triage_rows)
 
         rows = st.session_state.triage_rows
         if rows:
-            df = pd.DataFrame([{
-                "Study ID": r["study_id"],
-                "File": r["file"],
-                "Urgency": r["urgency"],
-                "Top Findings": r["top_summary"],
-            } for r in rows]).sort_values("Urgency", ascending=False).reset_index(drop=True)
+            df = (st.session_state.triage_df
+                  .sort_values("Urgency", ascending=False, kind="stable")
+                  .reset_index(drop=True))
             st.dataframe(df, use_container_width=True)
 
             st.markdown("### Inspect Selected Case")
@@ -78,12 +121,9 @@ if mode == "Technician":
                 with c1:
                     st.markdown("**Scores**")
                     if R["scores"]:
-                        fig, ax = plt.subplots()
-                        names = list(R["scores"].keys()); vals = [R["scores"][k] for k in names]
-                        ax.bar(names, vals); ax.set_ylim(0, 1); ax.set_ylabel("Probability (0–1)")
-                        ax.set_xticklabels(names, rotation=20, ha="right")
-                        st.pyplot(fig)
-                        for k, v in sorted(R["scores"].items(), key=lambda kv: -kv[1]):
+                        ranked = sorted(R["scores"].items(), key=lambda kv: -kv[1])
+                        score_chart(ranked)
+                        for k, v in ranked:
                             st.write(f"{color_dot(v)} **{k}** — {v:.2f}")
                     else:
                         st.info("No scores returned.")
@@ -91,7 +131,7 @@ if mode == "Technician":
                     badge = "🔴" if R["urgency"] >= 0.7 else ("🟡" if R["urgency"] >= 0.4 else "🟢")
                     st.metric("Urgency (weighted)", f"{badge} {R['urgency']:.2f}")
                     st.markdown("**Narrative (VLM)**"); st.write(R["vlm"] or "—")
-                    fhir = make_fhir_diag_report(R["study_id"], R["scores"], R["vlm"])
+                    fhir = cached_fhir(R["study_id"], tuple(sorted(R["scores"].items())), R["vlm"])
                     colx, coly = st.columns([1,1])
                     colx.download_button("Download JSON",
                         data=json.dumps(R, indent=2), file_name=f"hoppr_result_{R['study_id']}.json",
@@ -111,30 +151,27 @@ if mode == "Technician":
         if run_single:
             if not uploaded:
                 st.error("Please upload a file first.")
-            elif not active_models:
+            elif not enabled:
                 st.error("Select at least one finding to screen.")
             else:
                 try:
+                    data = read_upload(uploaded)
                     study_id = create_study(prefix="single")
-                    add_image(study_id, uploaded.name, uploaded.read())
+                    add_image(study_id, uploaded.name, data)
                 except Exception as e:
                     st.error(f"Study/image failure: {e}")
                 else:
                     with st.spinner("Running classifiers & VLM..."):
-                        scores = run_classifiers(study_id, active_models)
-                        vlm_text = run_vlm(study_id)
+                        scores, vlm_text = run_classifiers_and_vlm(study_id, active_models)
                         urgency = compute_urgency(scores)
 
                     c1, c2 = st.columns([1,1])
                     with c1:
                         st.markdown("**Scores**")
                         if scores:
-                            fig, ax = plt.subplots()
-                            names = list(scores.keys()); vals = [scores[k] for k in names]
-                            ax.bar(names, vals); ax.set_ylim(0, 1); ax.set_ylabel("Probability (0–1)")
-                            ax.set_xticklabels(names, rotation=20, ha="right")
-                            st.pyplot(fig)
-                            for k, v in sorted(scores.items(), key=lambda kv: -kv[1]):
+                            ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+                            score_chart(ranked)
+                            for k, v in ranked:
                                 st.write(f"{color_dot(v)} **{k}** — {v:.2f}")
                         else:
                             st.info("No scores returned.")
@@ -145,13 +182,13 @@ if mode == "Technician":
 
                         export_obj = {
                             "study_id": study_id, "scores": scores, "urgency": urgency,
-                            "vlm_findings": vlm_text, "models": active_models,
+                            "vlm_findings": vlm_text, "models": dict(active_models),
                         }
                         colx, coly = st.columns([1,1])
                         colx.download_button("Download JSON",
                             data=json.dumps(export_obj, indent=2), file_name=f"hoppr_result_{study_id}.json",
                             mime="application/json", use_container_width=True)
-                        fhir = make_fhir_diag_report(study_id, scores, vlm_text)
+                        fhir = cached_fhir(study_id, tuple(sorted(scores.items())), vlm_text)
                         coly.download_button("Download FHIR JSON",
                             data=json.dumps(fhir, indent=2), file_name=f"fhir_{study_id}.json",
                             mime="application/json", use_container_width=True)
@@ -176,22 +213,21 @@ else:
             st.error("Please upload a file first.")
         else:
             try:
+                data = read_upload(uploaded)
                 study_id = create_study(prefix="patient")
-                add_image(study_id, uploaded.name, uploaded.read())
+                add_image(study_id, uploaded.name, data)
             except Exception as e:
                 st.error(f"Study/image failure: {e}")
             else:
                 # Focused subset for patient (tweak as needed)
-                patient_subset = {
-                    k: FINDING_MODELS[k]
-                    for k in ["Pneumothorax", "Pleural Effusion", "Cardiomegaly",
-                              "Consolidation", "ILD"]
-                    if k in FINDING_MODELS
-                }
+                patient_subset = [
+                    (k, m) for k, m in CLASSIFIER_MODELS
+                    if k in {"Pneumothorax", "Pleural Effusion", "Cardiomegaly", "Consolidation", "ILD"}
+                ]
 
                 with st.spinner("Analyzing your image..."):
-                    scores, raw_payloads = run_classifiers_with_payload(study_id, patient_subset)
-                    vlm_text, vlm_payload = run_vlm_with_payload(study_id)
+                    (scores, raw_payloads), (vlm_text, vlm_payload) = \
+                        run_classifiers_and_vlm_with_payload(study_id, patient_subset)
                     vlm_hits = extract_keywords(vlm_text)
 
                 # ---------- Summary ----------
@@ -209,15 +245,10 @@ else:
                         st.success("Overall: likely no strong abnormalities detected.")
 
                     for k, v in sorted(scores.items(), key=lambda kv: -kv[1]):
-                        verdict_txt, tone = patient_verdict(v)
+                        verdict_txt, _ = patient_verdict(v)
                         # Override tone using chosen thresholds
-                        if v >= flag_thr:
-                            tone = "red"
-                        elif v >= maybe_thr:
-                            tone = "amber"
-                        else:
-                            tone = "green"
-                        color = {"red": "#f87171", "amber": "#f59e0b", "green": "#34d399"}[tone]
+                        tone = "red" if v >= flag_thr else "amber" if v >= maybe_thr else "green"
+                        color = TONE_COLORS[tone]
 
                         label = patient_label(k)
                         box = st.container()
@@ -244,6 +275,9 @@ else:
                 # ---------- Evidence for judges / debugging ----------
                 with st.expander("🔎 Raw API Evidence (per-model payloads)"):
                     st.write("**Study ID:**", study_id)
+                    dicom_meta = read_dicom_meta(data)
+                    if dicom_meta:
+                        st.json({"dicom": {k: (str(v) if v is not None else None) for k, v in dicom_meta.items()}})
                     st.json({"vlm": vlm_payload})
                     st.json({"classifiers": raw_payloads})
 
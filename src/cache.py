@@ -0,0 +1,36 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Any, Optional
+from .config import get_cache_dir
+
+# Content-addressed response cache: (image sha256, model id) -> parsed payload.
+# Stored as small JSON files sharded by the first two hex chars of the image hash.
+
+def _entry_path(image_sha: str, model_id: str) -> str:
+    key = hashlib.sha256(f"{image_sha}:{model_id}".encode("utf-8")).hexdigest()
+    return os.path.join(get_cache_dir(), image_sha[:2], f"{key}.json")
+
+def cache_get(image_sha: str, model_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_entry_path(image_sha, model_id), "r", encoding="utf-8") as fh:
+            entry = json.load(fh)
+        return entry if isinstance(entry, dict) else None
+    except Exception:
+        return None
+
+def cache_put(image_sha: str, model_id: str, entry: Dict[str, Any]) -> None:
+    """Best-effort write; a failed cache write never fails inference."""
+    path = _entry_path(image_sha, model_id)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(entry, fh)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
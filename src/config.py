@@ -8,3 +8,6 @@ def get_api_key() -> str:
     if not key:
         raise RuntimeError("Missing HOPPR_API_KEY (set it in .env).")
     return key
+
+def get_cache_dir() -> str:
+    return os.getenv("HOPPR_CACHE_DIR", ".hoppr_cache")
@@ -1,25 +1,24 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, Any
 
 def iso_now() -> str:
-    return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
 
 def make_fhir_diag_report(study_id: str, scores: Dict[str, float], vlm_text: str) -> Dict[str, Any]:
-    observations = []
-    for finding, score in scores.items():
-        observations.append({
-            "resourceType": "Observation",
-            "status": "final",
-            "code": {"text": finding},
-            "valueQuantity": {"value": round(score, 3), "unit": "probability (0-1)"},
-            "effectiveDateTime": iso_now(),
-        })
+    now = iso_now()  # one timestamp shared by the report and all of its observations
+    observations = [{
+        "resourceType": "Observation",
+        "status": "final",
+        "code": {"text": finding},
+        "valueQuantity": {"value": round(score, 3), "unit": "probability (0-1)"},
+        "effectiveDateTime": now,
+    } for finding, score in scores.items()]
     return {
         "resourceType": "DiagnosticReport",
         "status": "final",
         "category": [{"text": "Radiology"}],
         "code": {"text": "Chest radiograph AI assessment"},
-        "effectiveDateTime": iso_now(),
+        "effectiveDateTime": now,
         "conclusion": vlm_text,
         "result": observations,
         "presentedForm": [{
@@ -1,8 +1,16 @@
+import inspect
 import json
 import datetime as dt
 import re
-from typing import Dict, Any, Tuple, Optional, List
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Callable, Dict, Any, Iterable, Tuple, Optional, List
+import numpy as np
 from .hoppr_client import get_hoppr, HOPPR
+from .cache import cache_get, cache_put
+from .media import read_upload, sha256_hex
 
 # ---- Models (direct, aliases, and VLM-only via None) ----
 FINDING_MODELS: Dict[str, Optional[str]] = {
@@ -26,9 +34,17 @@ FINDING_MODELS: Dict[str, Optional[str]] = {
     "Normal": None,
 }
 
+# Runnable classifiers only (VLM-only findings dropped), in FINDING_MODELS order
+CLASSIFIER_MODELS: List[Tuple[str, str]] = [(k, v) for k, v in FINDING_MODELS.items() if v]
+
 CRITICAL_FINDINGS = {"Pneumothorax", "Pleural Effusion"}
 VLM_MODEL_ID = "cxr-vlm-experimental"
 
+# study_id -> sha256 of the uploaded image, used to key the response cache (oldest evicted first)
+_STUDY_SHA_MAX = 4096
+_STUDY_SHA: "OrderedDict[str, str]" = OrderedDict()
+_STUDY_SHA_LOCK = threading.Lock()
+
 # ---------- response normalization helpers ----------
 def _to_dict(maybe_obj: Any) -> Optional[Dict[str, Any]]:
     """Normalize HOPPR responses to dict whether dict, JSON string, or object.response."""
@@ -66,129 +82,171 @@ def create_study(prefix: str = "uiuc-mtchacks") -> str:
     s = hoppr.create_study(f"{prefix}-{dt.datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}")
     return extract_study_id(s)
 
-def add_image(study_id: str, filename: str, data: bytes) -> None:
-    """Robust wrapper for different SDK signatures."""
-    hoppr = get_hoppr()
-    try:
-        hoppr.add_study_image(study_id, filename, data)  # positional
-        return
-    except TypeError:
-        pass
-    try:
-        hoppr.add_study_image(study_id=study_id, reference=filename, data=data)  # kw 'data'
-        return
-    except TypeError:
-        pass
+@lru_cache()
+def _add_image_fn() -> Callable[[str, str, bytes], Any]:
+    """Resolve the SDK's add_study_image calling convention once instead of probing per upload."""
+    add = get_hoppr().add_study_image
     try:
-        hoppr.add_study_image(study_id=study_id, reference=filename, image_bytes=data)  # kw 'image_bytes'
-        return
-    except TypeError as e:
-        raise RuntimeError(f"add_study_image signature not recognized: {e}")
+        params = inspect.signature(add).parameters
+    except (TypeError, ValueError):
+        params = {}  # type: ignore[assignment]
+    if {"study_id", "reference", "image_bytes"} <= params.keys():
+        return lambda sid, fn, data: add(study_id=sid, reference=fn, image_bytes=data)
+    if {"study_id", "reference", "data"} <= params.keys():
+        return lambda sid, fn, data: add(study_id=sid, reference=fn, data=data)
+    return lambda sid, fn, data: add(sid, fn, data)  # positional
+
+def add_image(study_id: str, filename: str, data: bytes) -> None:
+    """Wrapper over add_study_image that adapts to the installed SDK signature."""
+    image_sha = sha256_hex(data)
+    _add_image_fn()(study_id, filename, data)
+    # Only after a successful upload, so failed studies never get a cache key
+    with _STUDY_SHA_LOCK:
+        _STUDY_SHA[study_id] = image_sha
+        while len(_STUDY_SHA) > _STUDY_SHA_MAX:
+            _STUDY_SHA.popitem(last=False)
 
 # ---------- core inference (simple) ----------
-def run_classifiers(study_id: str, models: Dict[str, Optional[str]]) -> Dict[str, float]:
+_MAX_CLASSIFIER_WORKERS = 16
+
+def _one_classifier(study_id: str, name: str, model_id: str) -> Tuple[str, Optional[float], Dict[str, Any]]:
+    """Prompt a single classifier; never raises, errors are returned in the payload."""
+    image_sha = _STUDY_SHA.get(study_id)
+    if image_sha:
+        hit = cache_get(image_sha, model_id)
+        if hit is not None:
+            return name, hit.get("score"), hit.get("payload") or {}
     hoppr = get_hoppr()
+    try:
+        resp = hoppr.prompt_model(
+            study_id, model=model_id, prompt="ignored for classification", organization="hoppr"
+        )
+        payload = _to_dict(resp) or _to_dict(getattr(resp, "response", resp)) or {}
+        s = _extract_score(payload) if isinstance(payload, dict) else None
+        if image_sha and s is not None:
+            cache_put(image_sha, model_id, {"score": s, "payload": payload})
+        return name, s, (payload if payload else {"note": "empty or unparsable payload"})
+    except Exception as e:
+        return name, None, {"error": str(e)}
+
+def _fan_out_classifiers(study_id: str, models: Iterable[Tuple[str, str]]) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    """Prompt all (name, model_id) classifiers concurrently (calls are I/O-bound on the HOPPR API)."""
+    runnable = list(models)
+    if not runnable:
+        return {}, {}
+    results: Dict[str, Tuple[Optional[float], Dict[str, Any]]] = {}
+    with ThreadPoolExecutor(max_workers=min(_MAX_CLASSIFIER_WORKERS, len(runnable))) as ex:
+        futures = [ex.submit(_one_classifier, study_id, name, model_id) for name, model_id in runnable]
+        for fut in as_completed(futures):
+            name, s, payload = fut.result()
+            results[name] = (s, payload)
+    # Re-assemble in the caller's model order so charts/exports stay stable
     scores: Dict[str, float] = {}
-    for name, model_id in models.items():
-        if not model_id:
-            continue
-        try:
-            resp = hoppr.prompt_model(
-                study_id, model=model_id, prompt="ignored for classification", organization="hoppr"
-            )
-            payload = _to_dict(resp) or _to_dict(getattr(resp, "response", resp))
-            if payload:
-                s = _extract_score(payload)
-                if s is not None:
-                    scores[name] = s
-        except Exception:
-            continue
+    payloads: Dict[str, Any] = {}
+    for name, _ in runnable:
+        s, payload = results[name]
+        if s is not None:
+            scores[name] = s
+        payloads[name] = payload
+    return scores, payloads
+
+def run_classifiers(study_id: str, models: Iterable[Tuple[str, str]]) -> Dict[str, float]:
+    scores, _ = _fan_out_classifiers(study_id, models)
     return scores
 
-def run_vlm(study_id: str) -> str:
+def _vlm_findings(payload: Dict[str, Any]) -> str:
+    if "findings" in payload and isinstance(payload["findings"], str):
+        return payload["findings"]
+    if "response" in payload and isinstance(payload["response"], dict):
+        inner = payload["response"]
+        if "findings" in inner and isinstance(inner["findings"], str):
+            return inner["findings"]
+    return ""
+
+def _vlm_payload(study_id: str) -> Dict[str, Any]:
+    """Prompt the VLM, served from the response cache when this image was seen before. May raise."""
+    image_sha = _STUDY_SHA.get(study_id)
+    if image_sha:
+        hit = cache_get(image_sha, VLM_MODEL_ID)
+        if hit is not None:
+            return hit.get("payload") or {}
     hoppr = get_hoppr()
+    resp = hoppr.prompt_model(
+        study_id,
+        model=VLM_MODEL_ID,
+        prompt="Provide a concise radiology-style description of key findings."
+    )
+    payload = _to_dict(resp) or _to_dict(getattr(resp, "response", resp)) or {}
+    if image_sha and isinstance(payload, dict) and _vlm_findings(payload):
+        cache_put(image_sha, VLM_MODEL_ID, {"payload": payload})
+    return payload
+
+def run_vlm(study_id: str) -> str:
     try:
-        resp = hoppr.prompt_model(
-            study_id,
-            model=VLM_MODEL_ID,
-            prompt="Provide a concise radiology-style description of key findings."
-        )
-        payload = _to_dict(resp) or _to_dict(getattr(resp, "response", resp))
-        if isinstance(payload, dict):
-            if "findings" in payload and isinstance(payload["findings"], str):
-                return payload["findings"]
-            if "response" in payload and isinstance(payload["response"], dict):
-                inner = payload["response"]
-                if "findings" in inner and isinstance(inner["findings"], str):
-                    return inner["findings"]
-        return ""
+        payload = _vlm_payload(study_id)
+        return _vlm_findings(payload) if isinstance(payload, dict) else ""
     except Exception:
         return ""
 
 # ---------- debuggable inference (with raw payloads) ----------
-def run_classifiers_with_payload(study_id: str, models: Dict[str, Optional[str]]) -> Tuple[Dict[str, float], Dict[str, Any]]:
-    hoppr = get_hoppr()
-    scores: Dict[str, float] = {}
-    payloads: Dict[str, Any] = {}
-    for name, model_id in models.items():
-        if not model_id:
-            continue
-        try:
-            resp = hoppr.prompt_model(
-                study_id, model=model_id, prompt="ignored for classification", organization="hoppr"
-            )
-            payload = _to_dict(resp) or _to_dict(getattr(resp, "response", resp)) or {}
-            s = _extract_score(payload) if isinstance(payload, dict) else None
-            if s is not None:
-                scores[name] = s
-            payloads[name] = payload if payload else {"note": "empty or unparsable payload"}
-        except Exception as e:
-            payloads[name] = {"error": str(e)}
-    return scores, payloads
+def run_classifiers_with_payload(study_id: str, models: Iterable[Tuple[str, str]]) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    return _fan_out_classifiers(study_id, models)
 
 def run_vlm_with_payload(study_id: str) -> Tuple[str, Dict[str, Any]]:
-    hoppr = get_hoppr()
     try:
-        resp = hoppr.prompt_model(
-            study_id,
-            model=VLM_MODEL_ID,
-            prompt="Provide a concise radiology-style description of key findings."
-        )
-        payload = _to_dict(resp) or _to_dict(getattr(resp, "response", resp)) or {}
-        findings = ""
-        if isinstance(payload, dict):
-            if "findings" in payload and isinstance(payload["findings"], str):
-                findings = payload["findings"]
-            elif "response" in payload and isinstance(payload["response"], dict):
-                inner = payload["response"]
-                if "findings" in inner and isinstance(inner["findings"], str):
-                    findings = inner["findings"]
+        payload = _vlm_payload(study_id)
+        findings = _vlm_findings(payload) if isinstance(payload, dict) else ""
         return findings, (payload if payload else {"note": "empty or unparsable payload"})
     except Exception as e:
         return "", {"error": str(e)}
 
+# ---------- overlapped classifier + VLM calls ----------
+# Classifiers and VLM are independent remote calls on the same study; once the image
+# upload has returned, both fan-outs are in flight together (latency ~ max, not sum).
+def run_classifiers_and_vlm(study_id: str, models: Iterable[Tuple[str, str]]) -> Tuple[Dict[str, float], str]:
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        scores_fut = ex.submit(run_classifiers, study_id, models)
+        vlm_fut = ex.submit(run_vlm, study_id)
+        return scores_fut.result(), vlm_fut.result()
+
+def run_classifiers_and_vlm_with_payload(
+    study_id: str, models: Iterable[Tuple[str, str]]
+) -> Tuple[Tuple[Dict[str, float], Dict[str, Any]], Tuple[str, Dict[str, Any]]]:
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        cls_fut = ex.submit(run_classifiers_with_payload, study_id, models)
+        vlm_fut = ex.submit(run_vlm_with_payload, study_id)
+        return cls_fut.result(), vlm_fut.result()
+
 # ---------- scoring / presentation helpers ----------
+_CRIT = frozenset(CRITICAL_FINDINGS)
+
 def compute_urgency(scores: Dict[str, float]) -> float:
-    vals = [(1.25 if k in CRITICAL_FINDINGS else 1.0) * v for k, v in scores.items()]
-    return max(vals) if vals else 0.0
+    if not scores:
+        return 0.0
+    weighted = np.fromiter(
+        ((1.25 if k in _CRIT else 1.0) * v for k, v in scores.items()),
+        dtype=np.float64, count=len(scores),
+    )
+    return float(weighted.max())
+
+_PATIENT_LABELS: Dict[str, str] = {
+    "Pneumothorax": "Collapsed lung",
+    "Pleural Effusion": "Fluid around the lungs",
+    "Cardiomegaly": "Enlarged heart",
+    "Lung Nodule or Mass": "Lung spot (nodule/mass)",
+    "Consolidation": "Area of lung filled (consolidation)",
+    "Lung Opacity": "Hazy area in lung (opacity)",
+    "Infiltration": "Hazy area in lung (infiltration)",
+    "ILD": "Scarring pattern (interstitial)",
+    "Pulmonary Fibrosis": "Lung scarring (fibrosis)",
+    "Aortic Enlargement": "Enlarged aorta",
+    "Calcification": "Calcium deposits",
+    "Pleural Thickening": "Thickened lining of lung",
+    "Normal": "No clear abnormality",
+}
 
 def patient_label(name: str) -> str:
-    mapping = {
-        "Pneumothorax": "Collapsed lung",
-        "Pleural Effusion": "Fluid around the lungs",
-        "Cardiomegaly": "Enlarged heart",
-        "Lung Nodule or Mass": "Lung spot (nodule/mass)",
-        "Consolidation": "Area of lung filled (consolidation)",
-        "Lung Opacity": "Hazy area in lung (opacity)",
-        "Infiltration": "Hazy area in lung (infiltration)",
-        "ILD": "Scarring pattern (interstitial)",
-        "Pulmonary Fibrosis": "Lung scarring (fibrosis)",
-        "Aortic Enlargement": "Enlarged aorta",
-        "Calcification": "Calcium deposits",
-        "Pleural Thickening": "Thickened lining of lung",
-        "Normal": "No clear abnormality",
-    }
-    return mapping.get(name, name)
+    return _PATIENT_LABELS.get(name, name)
 
 def patient_verdict(score: float) -> Tuple[str, str]:
     if score >= 0.7:  return ("Needs prompt attention", "red")
@@ -198,32 +256,26 @@ def patient_verdict(score: float) -> Tuple[str, str]:
 def is_likely_normal(scores: Dict[str, float], threshold: float = 0.30) -> bool:
     return bool(scores) and all(v < threshold for v in scores.values())
 
+_KEYWORDS = [
+    "pneumothorax", "effusion", "cardiomegaly", "opacity", "consolidation",
+    "infiltrate", "interstitial", "fibrosis", "calcification", "pleural thickening",
+    "aorta", "uncoiling", "enlarged", "nodule", "mass", "edema", "congestion"
+]
+_KW_RE = re.compile(r"\b(" + "|".join(map(re.escape, _KEYWORDS)) + r")\b")
+
 def extract_keywords(vlm_text: str) -> List[str]:
     """Simple keyword highlighter for patient view from VLM narrative."""
     if not vlm_text:
         return []
-    keywords = [
-        "pneumothorax", "effusion", "cardiomegaly", "opacity", "consolidation",
-        "infiltrate", "interstitial", "fibrosis", "calcification", "pleural thickening",
-        "aorta", "uncoiling", "enlarged", "nodule", "mass", "edema", "congestion"
-    ]
-    hits = []
-    lt = vlm_text.lower()
-    for k in keywords:
-        try:
-            if re.search(rf"\b{k}\b", lt):
-                hits.append(k)
-        except re.error:
-            pass
-    return sorted(set(hits))
+    return sorted(set(_KW_RE.findall(vlm_text.lower())))
 
 # ---------- pipeline helpers ----------
-def process_file(uploaded_file, models: Dict[str, Optional[str]]) -> Dict[str, Any]:
+def process_file(uploaded_file, models: List[Tuple[str, str]]) -> Dict[str, Any]:
     study_id = create_study()
-    add_image(study_id, uploaded_file.name, uploaded_file.read())
-    scores = run_classifiers(study_id, models)
+    data = read_upload(uploaded_file)
+    add_image(study_id, uploaded_file.name, data)
+    scores, vlm_text = run_classifiers_and_vlm(study_id, models)
     urgency = compute_urgency(scores)
-    vlm_text = run_vlm(study_id)
     top = sorted(scores.items(), key=lambda kv: -kv[1])[:3]
     top_summary = "; ".join([f"{k} {v:.2f}" for k, v in top]) if top else "—"
     return {"study_id": study_id, "file": uploaded_file.name, "urgency": urgency,
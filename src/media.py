@@ -1,20 +1,81 @@
 import hashlib
 from io import BytesIO
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, Optional, Union, BinaryIO
 import numpy as np
-from PIL import Image, ImageOps
+from PIL import Image
 import pydicom
 
-def sha256_hex(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
+def sha256_hex(data: Union[bytes, memoryview]) -> str:
+    # hashlib reads the buffer in place; no copy for bytes or memoryview
+    return hashlib.sha256(memoryview(data)).hexdigest()
+
+def sha256_stream(fp: BinaryIO) -> str:
+    """SHA-256 of a binary file object, read in chunks instead of materialized in memory."""
+    if hasattr(hashlib, "file_digest"):  # Python 3.11+
+        return hashlib.file_digest(fp, "sha256").hexdigest()
+    h = hashlib.sha256()
+    for chunk in iter(lambda: fp.read(1 << 16), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+def read_upload(uploaded_file) -> bytes:
+    """Bytes of an uploaded file, read once; getvalue() does not depend on the stream position."""
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    return uploaded_file.read()
 
 def _normalize_to_uint8(arr: np.ndarray) -> np.ndarray:
-    arr = arr.astype(np.float32)
-    mn, mx = np.min(arr), np.max(arr)
+    # min/max on the native dtype, then a single float32 scratch buffer updated in place
+    mn, mx = arr.min(), arr.max()
     if mx <= mn:
         return np.zeros(arr.shape, dtype=np.uint8)
-    arr = (arr - mn) / (mx - mn) * 255.0
-    return arr.clip(0, 255).astype(np.uint8)
+    scale = np.float32(255.0 / (float(mx) - float(mn)))
+    out = np.empty(arr.shape, dtype=np.float32)
+    np.subtract(arr, mn, out=out, dtype=np.float32)
+    out *= scale
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+_DICOM_META_TAGS = (
+    "Modality", "PatientID", "StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "StudyDate",
+)
+
+def _dicom_meta(ds: pydicom.Dataset) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {"kind": "DICOM"}
+    meta.update({tag: getattr(ds, tag, None) for tag in _DICOM_META_TAGS})
+    return meta
+
+# Non-identifying header fields only; safe to show in the UI (no patient/study identifiers)
+_DICOM_DISPLAY_TAGS = ("Modality", "Rows", "Columns")
+
+def read_dicom_meta(raw_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Header-only DICOM read for metadata panels; pixel data is never loaded or decoded.
+    Returns only non-identifying fields, or None when the bytes are not a DICOM file.
+    """
+    try:
+        ds = pydicom.dcmread(BytesIO(raw_bytes), stop_before_pixels=True, defer_size="1 KB")
+    except Exception:
+        return None
+    meta: Dict[str, Any] = {"kind": "DICOM"}
+    meta.update({tag: getattr(ds, tag, None) for tag in _DICOM_DISPLAY_TAGS})
+    return meta
+
+def _autocontrast(arr: np.ndarray, cutoff: float = 1.0) -> np.ndarray:
+    """
+    Percentile stretch of a uint8 array (cutoff % clipped at each end) via a 256-entry LUT.
+    Expects (rows, cols) or (rows, cols, channels); colour arrays are stretched per channel.
+    """
+    if arr.ndim == 3:
+        return np.stack([_autocontrast(arr[:, :, c], cutoff) for c in range(arr.shape[2])], axis=-1)
+    cdf = np.cumsum(np.bincount(arr.ravel(), minlength=256))
+    total = cdf[-1]
+    lo = int(np.searchsorted(cdf, total * cutoff / 100.0, side="right"))
+    hi = int(np.searchsorted(cdf, total * (100.0 - cutoff) / 100.0, side="left"))
+    if hi <= lo:
+        return arr
+    lut = np.clip((np.arange(256) - lo) * (255.0 / (hi - lo)), 0, 255).astype(np.uint8)
+    return lut[arr]
 
 def load_preview_and_meta(filename: str, raw_bytes: bytes) -> Tuple[Image.Image, Dict[str, Any]]:
     """
@@ -26,16 +87,9 @@ def load_preview_and_meta(filename: str, raw_bytes: bytes) -> Tuple[Image.Image,
 
     # Try DICOM first
     try:
-        ds = pydicom.dcmread(BytesIO(raw_bytes), force=True, stop_before_pixels=False)
-        meta.update({
-            "kind": "DICOM",
-            "Modality": getattr(ds, "Modality", None),
-            "PatientID": getattr(ds, "PatientID", None),
-            "StudyInstanceUID": getattr(ds, "StudyInstanceUID", None),
-            "SeriesInstanceUID": getattr(ds, "SeriesInstanceUID", None),
-            "SOPInstanceUID": getattr(ds, "SOPInstanceUID", None),
-            "StudyDate": getattr(ds, "StudyDate", None),
-        })
+        # defer_size: large non-pixel elements are only read if accessed
+        ds = pydicom.dcmread(BytesIO(raw_bytes), force=True, stop_before_pixels=False, defer_size="4 KB")
+        meta.update(_dicom_meta(ds))
         arr = ds.pixel_array  # type: ignore[attr-defined]
 
         # Windowing if present
@@ -56,16 +110,16 @@ def load_preview_and_meta(filename: str, raw_bytes: bytes) -> Tuple[Image.Image,
             pass
 
         prev = _normalize_to_uint8(arr)
+        # Some chest X-rays are inverted; ensure darker = denser.
+        # Stretch only after selecting the displayed plane/channels (multi-frame is (frames, rows, cols)).
         if prev.ndim == 2:
-            img = Image.fromarray(prev, mode="L")
+            img = Image.fromarray(_autocontrast(prev), mode="L")
         elif prev.ndim == 3 and prev.shape[2] >= 3:
-            img = Image.fromarray(prev[:, :, :3])
+            img = Image.fromarray(_autocontrast(prev[:, :, :3]))
         else:
             # Fallback: single channel
-            img = Image.fromarray(prev if prev.ndim == 2 else prev[:, :, 0])
+            img = Image.fromarray(_autocontrast(prev if prev.ndim == 2 else prev[:, :, 0]))
 
-        # Some chest X-rays are inverted; ensure darker = denser
-        img = ImageOps.autocontrast(img)
         meta.update({"Rows": getattr(ds, "Rows", None), "Columns": getattr(ds, "Columns", None)})
         return img, meta
     except Exception:
@@ -75,6 +129,6 @@ def load_preview_and_meta(filename: str, raw_bytes: bytes) -> Tuple[Image.Image,
     try:
         im = Image.open(BytesIO(raw_bytes))
         meta.update({"kind": "Image", "Mode": im.mode, "Size": im.size})
-        return ImageOps.autocontrast(im.convert("RGB")), meta
+        return Image.fromarray(_autocontrast(np.asarray(im.convert("RGB")))), meta
     except Exception:
         return Image.new("RGB", (256, 256), color=(20, 20, 20)), {**meta, "kind": "Unknown"}